@@ -0,0 +1,79 @@
+import numpy as np
+
+# Columns of the employees frame that analytics can be grouped by
+GROUP_COLUMNS = {"department": "Department", "position": "Position"}
+
+def hire_month(hire_date):
+    return str(hire_date)[:7]
+
+class EmployeeAggregates:
+    """Headcount, payroll and hires per month, kept up to date on every write.
+
+    The aggregates are built once from the loaded frame with vectorized
+    group-bys; afterwards add() and remove() adjust them per employee, so the
+    summary queries never rescan the data. Salary percentiles need the full
+    distribution: the sorted salaries of each group are cached until the next
+    write, and the requested percentiles are computed from them per query."""
+
+    def __init__(self, df):
+        self.rebuild(df)
+
+    def rebuild(self, df):
+        self.groups = {}
+        for column in GROUP_COLUMNS.values():
+            stats = df.groupby(column)["Salary"].agg(["count", "sum"])
+            self.groups[column] = {
+                key: [int(row["count"]), float(row["sum"])] for key, row in stats.iterrows()
+            }
+        months = df["Hire Date"].astype(str).str[:7].value_counts()
+        self.hires = {month: int(count) for month, count in months.items()}
+        self._sorted_salaries = {}
+
+    def add(self, row):
+        for column, groups in self.groups.items():
+            totals = groups.setdefault(row[column], [0, 0.0])
+            totals[0] += 1
+            totals[1] += float(row["Salary"])
+        month = hire_month(row["Hire Date"])
+        self.hires[month] = self.hires.get(month, 0) + 1
+        self._sorted_salaries.clear()
+
+    def remove(self, row):
+        for column, groups in self.groups.items():
+            totals = groups[row[column]]
+            totals[0] -= 1
+            totals[1] -= float(row["Salary"])
+            if totals[0] == 0:
+                del groups[row[column]]
+        month = hire_month(row["Hire Date"])
+        self.hires[month] -= 1
+        if self.hires[month] == 0:
+            del self.hires[month]
+        self._sorted_salaries.clear()
+
+    def summary(self, column):
+        return [
+            {
+                "group": key,
+                "headcount": count,
+                "salary_sum": total,
+                "salary_mean": total / count,
+            }
+            for key, (count, total) in sorted(self.groups[column].items())
+        ]
+
+    def hires_per_month(self):
+        return [{"month": month, "hires": count} for month, count in sorted(self.hires.items())]
+
+    def salary_percentiles(self, df, column, percentiles):
+        groups = self._sorted_salaries.get(column)
+        if groups is None:
+            groups = self._sorted_salaries[column] = {
+                key: np.sort(salaries.to_numpy()) for key, salaries in df.groupby(column)["Salary"]
+            }
+        labels = [f"p{p:g}" for p in percentiles]
+        quantiles = np.array(percentiles) / 100
+        return {
+            key: dict(zip(labels, np.quantile(salaries, quantiles).tolist()))
+            for key, salaries in groups.items()
+        }
@@ -1,12 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
+import numpy as np
 import pandas as pd
 from datetime import date
 import os
+from admission import AdmissionController, AdmissionMiddleware
+from analytics import GROUP_COLUMNS, EmployeeAggregates
+from profiling import PROFILING, MAX_PROFILE_SECONDS, ServerTimingMiddleware, TimedRoute, phase, sample_stacks
 
 app = FastAPI(title="Galaxium Travels HR API")
 
+if PROFILING:
+    # Must be set before the routes below are declared
+    app.router.route_class = TimedRoute
+    app.add_middleware(ServerTimingMiddleware)
+
+admission = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission, exempt_paths=("/admission_stats", "/debug/profile"))
+
 class Employee(BaseModel):
     id: Optional[int] = None
     first_name: str
@@ -16,15 +29,71 @@ class Employee(BaseModel):
     hire_date: date
     salary: float
 
+class EmployeeFields(BaseModel):
+    """An employee as listed by GET /employees; only the fields requested with `fields=` are present."""
+    id: Optional[int] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    department: Optional[str] = None
+    position: Optional[str] = None
+    hire_date: Optional[date] = None
+    salary: Optional[float] = None
+
+class GroupSummary(BaseModel):
+    group: str
+    headcount: int
+    salary_sum: float
+    salary_mean: float
+
+class MonthlyHires(BaseModel):
+    month: str
+    hires: int
+
+# Markdown table columns and the matching Employee fields
+COLUMNS = {
+    'ID': 'id',
+    'First Name': 'first_name',
+    'Last Name': 'last_name',
+    'Department': 'department',
+    'Position': 'position',
+    'Hire Date': 'hire_date',
+    'Salary': 'salary',
+}
+
+# Employees frame and its aggregates, loaded once and kept in sync with the file
+_employees = None
+_aggregates = None
+
 def read_employees():
     try:
-        df = pd.read_csv('data/employees.md', sep='|', skiprows=3)
-        df = df.iloc[:, 1:-1]  # Remove first and last empty columns
-        df.columns = [col.strip() for col in df.columns]
-        return df
+        with phase('db'):
+            df = pd.read_csv('data/employees.md', sep='|', skiprows=3, dtype=str)
+            df = df.iloc[:, 1:-1]  # Remove first and last empty columns
+            df.columns = [col.strip() for col in df.columns]
+            df = df.apply(lambda col: col.str.strip())
+            df = df[~df['ID'].str.fullmatch(r':?-+:?')]  # Remove the header separator row
+            df['ID'] = df['ID'].astype(int)
+            df['Salary'] = df['Salary'].astype(float)
+            return df.sort_values('ID').reset_index(drop=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading database: {str(e)}")
 
+def load_employees():
+    global _employees, _aggregates
+    if _employees is None:
+        _employees = read_employees()
+        _aggregates = EmployeeAggregates(_employees)
+    return _employees
+
+def to_row(employee: Employee, employee_id: int):
+    row = {column: getattr(employee, field) for column, field in COLUMNS.items()}
+    row['ID'] = employee_id
+    row['Hire Date'] = employee.hire_date.isoformat()
+    return row
+
+def to_employee(row):
+    return {field: row[column] for column, field in COLUMNS.items()}
+
 def write_employees(df):
     try:
         # Create the markdown header
@@ -32,56 +101,155 @@ def write_employees(df):
         # Convert DataFrame to markdown table
         markdown_table = df.to_markdown(index=False)
         # Write to file
-        with open('data/employees.md', 'w') as f:
+        with phase('db'), open('data/employees.md', 'w') as f:
             f.write(header + markdown_table)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error writing to database: {str(e)}")
+    global _employees
+    _employees = df
+
+@app.get("/employees", response_model=List[EmployeeFields])
+async def get_employees(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None,
+    department: Optional[str] = None,
+    position: Optional[str] = None,
+    hired_from: Optional[date] = None,
+    hired_to: Optional[date] = None,
+    min_salary: Optional[float] = None,
+    max_salary: Optional[float] = None,
+    fields: Optional[str] = None,
+):
+    """List employees ordered by ID, one page at a time.
+
+    When more employees match, the X-Next-Cursor response header holds the
+    value to pass as `cursor` for the next page. `fields` is a comma-separated
+    list of Employee fields to return (all fields by default)."""
+    df = load_employees()
+    if fields is None:
+        columns = list(COLUMNS)
+    else:
+        by_field = {field: column for column, field in COLUMNS.items()}
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        if not names:
+            raise HTTPException(status_code=400, detail="No fields requested")
+        unknown = [name for name in names if name not in by_field]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        columns = [by_field[name] for name in names]
 
-@app.get("/employees", response_model=List[Employee])
-async def get_employees():
-    df = read_employees()
-    return df.to_dict('records')
+    # The frame is sorted by ID, so the cursor is a binary search
+    if cursor is not None:
+        df = df.iloc[df['ID'].searchsorted(cursor, side='right'):]
+    mask = np.ones(len(df), dtype=bool)
+    if department is not None:
+        mask &= (df['Department'] == department).to_numpy()
+    if position is not None:
+        mask &= (df['Position'] == position).to_numpy()
+    # ISO dates compare correctly as strings
+    if hired_from is not None:
+        mask &= (df['Hire Date'] >= hired_from.isoformat()).to_numpy()
+    if hired_to is not None:
+        mask &= (df['Hire Date'] <= hired_to.isoformat()).to_numpy()
+    if min_salary is not None:
+        mask &= (df['Salary'] >= min_salary).to_numpy()
+    if max_salary is not None:
+        mask &= (df['Salary'] <= max_salary).to_numpy()
+    positions = np.flatnonzero(mask)[:limit + 1]
+
+    page = df.iloc[positions[:limit]]
+    headers = {}
+    if len(positions) > limit:
+        headers['X-Next-Cursor'] = str(int(page['ID'].iloc[-1]))
+    # Serialize the page in one vectorized pass instead of validating row by row
+    with phase('serialize'):
+        body = page[columns].rename(columns=COLUMNS).to_json(orient='records')
+    return Response(content=body, media_type='application/json', headers=headers)
 
 @app.get("/employees/{employee_id}", response_model=Employee)
 async def get_employee(employee_id: int):
-    df = read_employees()
+    df = load_employees()
     employee = df[df['ID'] == employee_id]
     if employee.empty:
         raise HTTPException(status_code=404, detail="Employee not found")
-    return employee.iloc[0].to_dict()
+    return to_employee(employee.iloc[0])
 
 @app.post("/employees", response_model=Employee)
 async def create_employee(employee: Employee):
-    df = read_employees()
-    new_id = df['ID'].max() + 1 if not df.empty else 1
-    employee_dict = employee.dict()
-    employee_dict['ID'] = new_id
-    df = pd.concat([df, pd.DataFrame([employee_dict])], ignore_index=True)
+    df = load_employees()
+    new_id = int(df['ID'].max()) + 1 if not df.empty else 1
+    row = to_row(employee, new_id)
+    df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
     write_employees(df)
-    return employee_dict
+    _aggregates.add(row)
+    return to_employee(row)
 
 @app.put("/employees/{employee_id}", response_model=Employee)
 async def update_employee(employee_id: int, employee: Employee):
-    df = read_employees()
-    if employee_id not in df['ID'].values:
+    df = load_employees()
+    mask = df['ID'] == employee_id
+    if not mask.any():
         raise HTTPException(status_code=404, detail="Employee not found")
     
-    employee_dict = employee.dict()
-    employee_dict['ID'] = employee_id
-    df.loc[df['ID'] == employee_id] = employee_dict
+    old_row = df[mask].iloc[0].to_dict()
+    row = to_row(employee, employee_id)
+    df = df.copy()
+    df.loc[mask, list(row)] = list(row.values())
     write_employees(df)
-    return employee_dict
+    _aggregates.remove(old_row)
+    _aggregates.add(row)
+    return to_employee(row)
 
 @app.delete("/employees/{employee_id}")
 async def delete_employee(employee_id: int):
-    df = read_employees()
-    if employee_id not in df['ID'].values:
+    df = load_employees()
+    mask = df['ID'] == employee_id
+    if not mask.any():
         raise HTTPException(status_code=404, detail="Employee not found")
     
-    df = df[df['ID'] != employee_id]
-    write_employees(df)
+    old_row = df[mask].iloc[0].to_dict()
+    write_employees(df[~mask].reset_index(drop=True))
+    _aggregates.remove(old_row)
     return {"message": "Employee deleted successfully"}
 
+@app.get("/analytics/summary", response_model=List[GroupSummary])
+async def get_summary(group_by: Literal['department', 'position'] = 'department'):
+    """Headcount and salary sum/mean per department or position."""
+    load_employees()
+    return _aggregates.summary(GROUP_COLUMNS[group_by])
+
+@app.get("/analytics/salary_percentiles", response_model=Dict[str, Dict[str, float]])
+async def get_salary_percentiles(
+    group_by: Literal['department', 'position'] = 'department',
+    percentiles: List[float] = Query([25, 50, 75, 90]),
+):
+    """Salary percentiles (0-100) per department or position, keyed as p25, p50, ..."""
+    if any(p < 0 or p > 100 for p in percentiles):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+    df = load_employees()
+    return _aggregates.salary_percentiles(df, GROUP_COLUMNS[group_by], sorted(set(percentiles)))
+
+@app.get("/analytics/hires_per_month", response_model=List[MonthlyHires])
+async def get_hires_per_month():
+    load_employees()
+    return _aggregates.hires_per_month()
+
+@app.get("/admission_stats")
+async def get_admission_stats():
+    return admission.stats()
+
+if PROFILING:
+    @app.get("/debug/profile", response_class=PlainTextResponse)
+    async def profile(
+        seconds: float = Query(5, gt=0, le=MAX_PROFILE_SECONDS),
+        interval_ms: float = Query(10, ge=1, le=1000),
+    ):
+        """Sample all threads and return collapsed stacks for flamegraph.pl or speedscope."""
+        try:
+            return await sample_stacks(seconds, interval_ms / 1000)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
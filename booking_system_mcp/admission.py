@@ -0,0 +1,197 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+# Defaults can be overridden with environment variables. Per-client limits are
+# opt-in: a rate of 0 (the default) disables them and only the concurrency cap applies.
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", "0"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "20"))
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "32"))
+MAX_QUEUE = int(os.environ.get("MAX_QUEUE", "64"))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "2"))
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take one token. Returns 0 on success, otherwise the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class AdmissionController:
+    """Per-client token buckets plus a global concurrency cap with a bounded FIFO queue.
+
+    All state lives on the event loop, so no locking is needed."""
+
+    def __init__(
+        self,
+        rate=RATE_LIMIT_PER_SECOND,
+        burst=RATE_LIMIT_BURST,
+        max_concurrency=MAX_CONCURRENCY,
+        max_queue=MAX_QUEUE,
+        queue_timeout=QUEUE_TIMEOUT,
+        max_clients=10000,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._waiters = deque()
+        self._in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    def check_rate(self, client_key):
+        """Returns 0 if the client may proceed, otherwise the Retry-After delay in seconds."""
+        if self.rate <= 0:
+            return 0
+        bucket = self._buckets.get(client_key)
+        if bucket is None:
+            bucket = self._buckets[client_key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_key)
+        retry_after = bucket.take()
+        if retry_after:
+            self.rate_limited += 1
+        return retry_after
+
+    async def acquire(self):
+        """Wait for a concurrency slot. Returns False if the request must be shed."""
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            # On Python 3.12+ the timeout can fire after release() already handed us the slot
+            if waiter.done() and not waiter.cancelled():
+                self.admitted += 1
+                return True
+            self.shed += 1
+            return False
+        except BaseException:
+            self._discard(waiter)
+            # The slot may have been handed over just before we were cancelled
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        self.admitted += 1
+        return True
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        # Hand the slot straight to the next waiter so queued requests keep FIFO order
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def stats(self):
+        return {
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "tracked_clients": len(self._buckets),
+        }
+
+def client_key(scope):
+    """Identify the caller: API key, then MCP session, then user id, then client address.
+
+    The user id is only taken from the X-User-Id header: the endpoints carry it in
+    the path or body, which is not available before routing, so per-user limits
+    need callers to send the header. None of these identities are authenticated
+    here, so a client can get a fresh bucket by changing them; the limits only
+    restrain well-meaning but runaway callers. Behind a proxy the client address is the proxy's unless uvicorn is
+    started with --proxy-headers --forwarded-allow-ips."""
+    headers = Headers(scope=scope)
+    api_key = headers.get("x-api-key") or headers.get("authorization")
+    if api_key:
+        return "key:" + api_key
+    session_id = headers.get("mcp-session-id") or headers.get("x-session-id")
+    if session_id:
+        return "session:" + session_id
+    user_id = headers.get("x-user-id")
+    if user_id:
+        return "user:" + user_id
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+class AdmissionMiddleware:
+    """ASGI middleware that rejects with 429/503 and Retry-After instead of letting load pile up.
+
+    Requests to exempt_paths, or for which exempt(scope) is true (e.g. long-lived
+    event streams that must not hold a slot), bypass admission."""
+
+    def __init__(self, app, controller, exempt_paths=("/",), exempt=None):
+        self.app = app
+        self.controller = controller
+        self.exempt_paths = set(exempt_paths)
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] in self.exempt_paths
+            or (self.exempt is not None and self.exempt(scope))
+        ):
+            await self.app(scope, receive, send)
+            return
+        retry_after = self.controller.check_rate(client_key(scope))
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Rate limit exceeded"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+        if not await self.controller.acquire():
+            response = JSONResponse(
+                {"detail": "Server overloaded, try again later"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(self.controller.queue_timeout)))},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
@@ -1,14 +1,124 @@
+import math
+import os
 from fastmcp import FastMCP
+from fastmcp.server.dependencies import get_http_request
 from pydantic import BaseModel
-from db import SessionLocal, init_db
+from db import init_db, get_engine, get_session_factory, snapshot_db, restore_db, drop_session_db, SessionExpiredError, SessionLimitError
 from seed import seed
+from admission import AdmissionController, AdmissionMiddleware
+from singleflight import SingleFlight
+from profiling import PROFILING, MAX_PROFILE_SECONDS, ServerTimingMiddleware, instrument_sqlalchemy, sample_stacks, timed_handler
 from models import User, Flight, Booking
 from datetime import datetime
+from starlette.datastructures import Headers
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
 from starlette.requests import Request
-from starlette.responses import PlainTextResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 
 mcp = FastMCP("Booking System MCP")
 
+admission = AdmissionController()
+
+# Concurrent identical read tool calls share a single database query
+reads = SingleFlight()
+
+if PROFILING:
+    instrument_sqlalchemy()
+
+# Opt-in transport change: SSE responses start before the tool runs, so they get no Server-Timing header
+PROFILING_JSON_RESPONSE = PROFILING and os.environ.get("PROFILING_JSON_RESPONSE", "").lower() in ("1", "true", "yes")
+
+# Give every MCP session its own database, even without an X-Session-Id header
+ISOLATE_MCP_SESSIONS = os.environ.get("ISOLATE_MCP_SESSIONS", "").lower() in ("1", "true", "yes")
+
+class DropSessionDbOnTerminate:
+    """Delete an MCP session's isolated database when the client terminates the session (DELETE /mcp).
+
+    Sessions that are never terminated are deleted by db.py once they have been idle."""
+
+    def __init__(self, app, path="/mcp"):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http" and scope["method"] == "DELETE" and scope["path"].rstrip("/") == self.path:
+            session_id = Headers(scope=scope).get("mcp-session-id")
+            if session_id:
+                drop_session_db(session_id)
+
+class CheckSessionDb:
+    """Resolve the request's isolated database before FastMCP sees the request.
+
+    Tool errors travel inside the JSON-RPC response, so this is where running out
+    of session databases becomes a 503 with Retry-After and an expired session a 410.
+    DELETE requests (session termination and /sessions/{id}) are passed through."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] != "DELETE":
+            session_id = _session_id(Request(scope))
+            if session_id is not None:
+                try:
+                    await run_in_threadpool(get_engine, session_id)
+                except SessionLimitError as e:
+                    response = JSONResponse(
+                        {"detail": str(e)},
+                        status_code=503,
+                        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+                    )
+                    await response(scope, receive, send)
+                    return
+                except SessionExpiredError as e:
+                    await JSONResponse({"detail": str(e)}, status_code=410)(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+def _is_mcp_event_stream(scope):
+    # The long-lived GET stream of the MCP transport must not hold a concurrency slot
+    return (
+        scope["method"] == "GET"
+        and scope["path"].rstrip("/") == "/mcp"
+        and "text/event-stream" in Headers(scope=scope).get("accept", "")
+    )
+
+def _session_id(request):
+    session_id = request.headers.get("x-session-id")
+    if session_id is None and ISOLATE_MCP_SESSIONS:
+        session_id = request.headers.get("mcp-session-id")
+    return session_id
+
+def current_session_id():
+    try:
+        request = get_http_request()
+    except RuntimeError:
+        # No HTTP request (e.g. stdio transport): use the shared database
+        return None
+    return _session_id(request)
+
+def request_timing():
+    # Tools run outside the HTTP request's context, so the timing is found through the request
+    try:
+        request = get_http_request()
+    except RuntimeError:
+        return None
+    return getattr(request.state, "server_timing", None)
+
+def tool():
+    """Register an MCP tool, recording its start and end for Server-Timing when profiling."""
+    def decorator(fn):
+        return mcp.tool()(timed_handler(fn, request_timing) if PROFILING else fn)
+    return decorator
+
+def open_session(session_id=None):
+    """Open a DB session on the shared database or on the isolated one selected by the request."""
+    if session_id is None:
+        session_id = current_session_id()
+    return get_session_factory(session_id)()
+
 # Pydantic models for structured output
 class FlightOut(BaseModel):
     flight_id: int
@@ -46,22 +156,25 @@ class UserOut(BaseModel):
     class Config:
         from_attributes = True
 
-@mcp.tool()
+@tool()
 def list_flights() -> list[FlightOut]:
     """List all available flights. 
     Returns a list of flights with origin, destination, times, price, and seats available."""
-    db = SessionLocal()
-    flights = db.query(Flight).all()
-    db.close()
-    return [FlightOut.from_orm(f) for f in flights]
+    session_id = current_session_id()
+    def query():
+        db = open_session(session_id)
+        flights = db.query(Flight).all()
+        db.close()
+        return [FlightOut.from_orm(f) for f in flights]
+    return reads.do((session_id, "list_flights"), query)
 
-@mcp.tool()
+@tool()
 def book_flight(user_id: int, name: str, flight_id: int) -> BookingOut:
     """Book a seat on a specific flight for a user. 
     Requires user_id, name, and flight_id. 
     Decrements available seats if successful. 
     Returns booking details or raises an error if booking is not possible."""
-    db = SessionLocal()
+    db = open_session()
     flight = db.query(Flight).filter(Flight.flight_id == flight_id).first()
     if not flight:
         db.close()
@@ -81,28 +194,33 @@ def book_flight(user_id: int, name: str, flight_id: int) -> BookingOut:
         booking_time=datetime.utcnow().isoformat()
     )
     db.add(new_booking)
+    reads.invalidate()
     db.commit()
     db.refresh(new_booking)
     db.commit()
+    reads.invalidate()
     out = BookingOut.from_orm(new_booking)
     db.close()
     return out
 
-@mcp.tool()
+@tool()
 def get_bookings(user_id: int) -> list[BookingOut]:
     """Retrieve all bookings for a specific user by user_id. 
     Returns a list of booking details for the user."""
-    db = SessionLocal()
-    bookings = db.query(Booking).filter(Booking.user_id == user_id).all()
-    db.close()
-    return [BookingOut.from_orm(b) for b in bookings]
+    session_id = current_session_id()
+    def query():
+        db = open_session(session_id)
+        bookings = db.query(Booking).filter(Booking.user_id == user_id).all()
+        db.close()
+        return [BookingOut.from_orm(b) for b in bookings]
+    return reads.do((session_id, "get_bookings", user_id), query)
 
-@mcp.tool()
+@tool()
 def cancel_booking(booking_id: int) -> BookingOut:
     """Cancel an existing booking by its booking_id. 
     Increments available seats for the flight if successful. 
     Returns updated booking details or raises an error if already cancelled or not found."""
-    db = SessionLocal()
+    db = open_session()
     booking = db.query(Booking).filter(Booking.booking_id == booking_id).first()
     if not booking:
         db.close()
@@ -114,49 +232,123 @@ def cancel_booking(booking_id: int) -> BookingOut:
     if flight:
         flight.seats_available += 1
     booking.status = "cancelled"
+    reads.invalidate()
     db.commit()
+    reads.invalidate()
     db.refresh(booking)
     out = BookingOut.from_orm(booking)
     db.close()
     return out
 
-@mcp.tool()
+@tool()
 def register_user(name: str, email: str) -> UserOut:
     """Register a new user with a name and unique email. 
     Returns the created user's details or raises an error if the email is already registered."""
-    db = SessionLocal()
+    db = open_session()
     existing = db.query(User).filter(User.email == email).first()
     if existing:
         db.close()
         raise Exception("Email already registered")
     new_user = User(name=name, email=email)
     db.add(new_user)
+    reads.invalidate()
     db.commit()
+    reads.invalidate()
     db.refresh(new_user)
     out = UserOut.from_orm(new_user)
     db.close()
     return out
 
-@mcp.tool()
+@tool()
 def get_user_id(name: str, email: str) -> UserOut:
     """Retrieve a user's information, including user_id, by providing both name and email. 
     Returns user details or raises an error if not found."""
-    db = SessionLocal()
-    user = db.query(User).filter(User.name == name, User.email == email).first()
-    if not user:
+    session_id = current_session_id()
+    def query():
+        db = open_session(session_id)
+        user = db.query(User).filter(User.name == name, User.email == email).first()
+        if not user:
+            db.close()
+            raise Exception("User not found")
+        out = UserOut.from_orm(user)
         db.close()
-        raise Exception("User not found")
-    out = UserOut.from_orm(user)
-    db.close()
-    return out
+        return out
+    return reads.do((session_id, "get_user_id", name, email), query)
 
 @mcp.custom_route("/", methods=["GET"])
 async def root_health_check(request: Request) -> PlainTextResponse:
     return PlainTextResponse("OK")
 
-# Initialize DB and seed data on startup
+@mcp.custom_route("/admission_stats", methods=["GET"])
+async def admission_stats(request: Request) -> JSONResponse:
+    return JSONResponse(admission.stats())
+
+@mcp.custom_route("/coalescing_stats", methods=["GET"])
+async def coalescing_stats(request: Request) -> JSONResponse:
+    return JSONResponse(reads.stats())
+
+@mcp.custom_route("/debug/profile", methods=["GET"])
+async def profile(request: Request) -> PlainTextResponse:
+    """Sample all threads and return collapsed stacks for flamegraph.pl or speedscope."""
+    if not PROFILING:
+        return PlainTextResponse("Profiling is disabled", status_code=404)
+    try:
+        seconds = float(request.query_params.get("seconds", 5))
+        interval_ms = float(request.query_params.get("interval_ms", 10))
+    except ValueError:
+        return PlainTextResponse("seconds and interval_ms must be numbers", status_code=400)
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or not 1 <= interval_ms <= 1000:
+        return PlainTextResponse(f"seconds must be in (0, {MAX_PROFILE_SECONDS}] and interval_ms in [1, 1000]", status_code=400)
+    try:
+        return PlainTextResponse(await sample_stacks(seconds, interval_ms / 1000))
+    except RuntimeError as e:
+        return PlainTextResponse(str(e), status_code=409)
+
+@mcp.custom_route("/snapshot", methods=["POST"])
+async def take_snapshot(request: Request) -> JSONResponse:
+    snapshot_db(_session_id(request))
+    return JSONResponse({"message": "Database snapshot captured successfully."})
+
+@mcp.custom_route("/restore", methods=["POST"])
+async def restore_snapshot(request: Request) -> JSONResponse:
+    reads.invalidate()
+    try:
+        restore_db(_session_id(request))
+    except RuntimeError as e:
+        return JSONResponse({"detail": str(e)}, status_code=409)
+    reads.invalidate()
+    return JSONResponse({"message": "Database restored from snapshot successfully."})
+
+@mcp.custom_route("/sessions/{session_id}", methods=["DELETE"])
+async def drop_session(request: Request) -> JSONResponse:
+    if not drop_session_db(request.path_params["session_id"]):
+        return JSONResponse({"detail": "Session not found"}, status_code=404)
+    return JSONResponse({"message": "Session database deleted successfully."})
+
+# Initialize DB and seed data on startup, then keep a snapshot of the seeded state
 init_db()
 seed()
+snapshot_db()
 
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http", host="0.0.0.0", port=8080)
\ No newline at end of file
+    middleware = [
+        Middleware(
+            AdmissionMiddleware,
+            controller=admission,
+            exempt_paths=("/", "/admission_stats", "/debug/profile"),
+            exempt=_is_mcp_event_stream,
+        )
+    ]
+    if PROFILING:
+        middleware.append(Middleware(ServerTimingMiddleware))
+    middleware.append(Middleware(CheckSessionDb))
+    if ISOLATE_MCP_SESSIONS:
+        middleware.append(Middleware(DropSessionDbOnTerminate))
+    mcp.run(
+        transport="streamable-http",
+        host="0.0.0.0",
+        port=8080,
+        middleware=middleware,
+        # Plain JSON responses are sent after the tool has run, so Server-Timing can cover it
+        json_response=True if PROFILING_JSON_RESPONSE else None,
+    )
\ No newline at end of file
@@ -0,0 +1,216 @@
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
+
+# Profiling is opt-in: set PROFILING=1 to add Server-Timing headers and the sampling profiler endpoint
+PROFILING = os.environ.get("PROFILING", "").lower() in ("1", "true", "yes")
+
+MAX_PROFILE_SECONDS = 60
+
+class RequestTiming:
+    """Timestamps and accumulated phase durations for one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.handler_start = None
+        self.handler_end = None
+        self.phases = Counter()
+
+    def header(self, now):
+        total = now - self.start
+        parts = []
+        if self.handler_start is not None and self.handler_end is not None:
+            # Serialization can happen inside the handler (explicit 'serialize' phase) and after it
+            handler = self.handler_end - self.handler_start
+            db, serialize = self.phases["db"], self.phases["serialize"]
+            parts.append(("validation", self.handler_start - self.start))
+            parts.append(("db", db))
+            parts.append(("app", max(handler - db - serialize, 0)))
+            parts.append(("serialize", now - self.handler_end + serialize))
+        elif self.phases["db"]:
+            parts.append(("db", self.phases["db"]))
+        parts.append(("total", total))
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in parts)
+
+_current_timing = ContextVar("request_timing", default=None)
+
+def current_timing():
+    return _current_timing.get()
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to the current request's phase."""
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.phases[name] += time.perf_counter() - start
+
+def timed_handler(fn, get_timing=current_timing):
+    """Wrap an endpoint or tool so its start and end are recorded on the request timing.
+
+    The signature is preserved so FastAPI and FastMCP see the original parameters."""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            timing = get_timing()
+            if timing is None:
+                return await fn(*args, **kwargs)
+            token = _current_timing.set(timing)
+            timing.handler_start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                timing.handler_end = time.perf_counter()
+                _current_timing.reset(token)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timing = get_timing()
+            if timing is None:
+                return fn(*args, **kwargs)
+            token = _current_timing.set(timing)
+            timing.handler_start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timing.handler_end = time.perf_counter()
+                _current_timing.reset(token)
+    return wrapper
+
+class TimedRoute(APIRoute):
+    """APIRoute that records when the endpoint body runs, separating request validation
+    (before) from response serialization (after)."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, timed_handler(endpoint), **kwargs)
+
+def instrument_sqlalchemy():
+    """Count time spent executing SQL statements, on every engine, as the 'db' phase."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _finish_query(conn):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        start = starts.pop()
+        timing = _current_timing.get()
+        if timing is not None:
+            timing.phases["db"] += time.perf_counter() - start
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _finish_query(conn)
+
+    # A failing statement never reaches after_cursor_execute; drop its start time here
+    @event.listens_for(Engine, "handle_error")
+    def _handle_error(exception_context):
+        if exception_context.connection is not None:
+            _finish_query(exception_context.connection)
+
+def _is_event_stream(message):
+    content_type = Headers(raw=message.get("headers", [])).get("content-type", "")
+    return content_type.startswith("text/event-stream")
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding a Server-Timing header with the phases of each request.
+
+    Server-sent event responses are left without the header. The timing is also
+    stored in the request state as 'server_timing' for handlers that do not run
+    in the request's context (e.g. MCP tools)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        scope.setdefault("state", {})["server_timing"] = timing
+
+        async def send_with_timing(message):
+            # Event streams start before the handler has run, so their timing would be meaningless
+            if message["type"] == "http.response.start" and not _is_event_stream(message):
+                header = timing.header(time.perf_counter())
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        token = _current_timing.set(timing)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timing.reset(token)
+
+_profile_lock = threading.Lock()
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _sample(seconds, interval):
+    sampler = threading.get_ident()
+    names = {}
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if len(names) != threading.active_count():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == sampler:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+async def sample_stacks(seconds, interval=0.01):
+    """Sample the stacks of all threads for `seconds` and return them in collapsed
+    (flamegraph.pl / speedscope) format, one 'frame;frame;... count' line per stack.
+
+    Sampling runs in its own thread so the event loop keeps serving requests.
+    Raises RuntimeError if a profile is already running."""
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def resolve(setter, value):
+        # The request may have been cancelled (client went away) while sampling
+        if not done.done():
+            setter(value)
+
+    def run():
+        try:
+            result = _sample(seconds, interval)
+        except BaseException as e:
+            loop.call_soon_threadsafe(resolve, done.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, done.set_result, result)
+        finally:
+            _profile_lock.release()
+
+    threading.Thread(target=run, name="stack-sampler", daemon=True).start()
+    return await done
@@ -1,17 +1,57 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import json
+import math
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sqlalchemy.orm import Session
 from models import User, Flight, Booking
-from db import get_db, init_db
+from db import get_db, init_db, current_session_id, snapshot_db, restore_db, drop_session_db, SessionExpiredError, SessionLimitError
 from seed import seed
+from admission import AdmissionController, AdmissionMiddleware
+from singleflight import SingleFlight
+from profiling import PROFILING, MAX_PROFILE_SECONDS, ServerTimingMiddleware, TimedRoute, instrument_sqlalchemy, phase, sample_stacks
 from pydantic import BaseModel
 from datetime import datetime
 
 app = FastAPI()
 
+if PROFILING:
+    # Must be set before the routes below are declared
+    app.router.route_class = TimedRoute
+    app.add_middleware(ServerTimingMiddleware)
+    instrument_sqlalchemy()
+
+admission = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission, exempt_paths=("/admission_stats", "/debug/profile"))
+
+reads = SingleFlight()
+
 @app.on_event("startup")
 def on_startup():
     init_db()
     seed()
+    snapshot_db()
+
+@app.middleware("http")
+async def select_session_db(request: Request, call_next):
+    # Requests carrying X-Session-Id run against their own isolated database
+    token = current_session_id.set(request.headers.get("x-session-id"))
+    try:
+        return await call_next(request)
+    finally:
+        current_session_id.reset(token)
+
+@app.exception_handler(SessionLimitError)
+async def session_limit_exceeded(request: Request, exc: SessionLimitError):
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+@app.exception_handler(SessionExpiredError)
+async def session_expired(request: Request, exc: SessionExpiredError):
+    return JSONResponse({"detail": str(exc)}, status_code=410)
 
 class FlightOut(BaseModel):
     flight_id: int
@@ -22,7 +62,7 @@ class FlightOut(BaseModel):
     price: int
     seats_available: int
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 class BookingIn(BaseModel):
     user_id: int
@@ -36,7 +76,7 @@ class BookingOut(BaseModel):
     status: str
     booking_time: str
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 class UserIn(BaseModel):
     name: str
@@ -47,7 +87,16 @@ class UserOut(BaseModel):
     name: str
     email: str
     class Config:
-        orm_mode = True
+        from_attributes = True
+
+def coalesced_json(key, query):
+    """Run query once for all concurrent identical requests and share its encoded JSON body."""
+    def run():
+        result = query()
+        with phase("serialize"):
+            return json.dumps(jsonable_encoder(result)).encode("utf-8")
+    body = reads.do((current_session_id.get(),) + key, run)
+    return Response(content=body, media_type="application/json")
 
 @app.get(
     "/flights",
@@ -56,7 +105,10 @@ class UserOut(BaseModel):
     description="Retrieve a list of all available flights, including origin, destination, departure and arrival times, price, and the number of seats currently available for booking."
 )
 def list_flights(db: Session = Depends(get_db)):
-    return db.query(Flight).all()
+    return coalesced_json(
+        ("flights",),
+        lambda: [FlightOut.from_orm(f) for f in db.query(Flight).all()],
+    )
 
 @app.post(
     "/book",
@@ -93,9 +145,11 @@ def book_flight(booking: BookingIn, db: Session = Depends(get_db)):
         booking_time=datetime.utcnow().isoformat()
     )
     db.add(new_booking)
+    reads.invalidate()
     db.commit()
     db.refresh(new_booking)
     db.commit()
+    reads.invalidate()
     return new_booking
 
 @app.get(
@@ -105,7 +159,10 @@ def book_flight(booking: BookingIn, db: Session = Depends(get_db)):
     description="Retrieve all bookings for a specific user by user_id. Returns a list of bookings, including booking status and booking time, for the given user."
 )
 def get_bookings(user_id: int, db: Session = Depends(get_db)):
-    return db.query(Booking).filter(Booking.user_id == user_id).all()
+    return coalesced_json(
+        ("bookings", user_id),
+        lambda: [BookingOut.from_orm(b) for b in db.query(Booking).filter(Booking.user_id == user_id).all()],
+    )
 
 @app.post(
     "/cancel/{booking_id}",
@@ -123,7 +180,9 @@ def cancel_booking(booking_id: int, db: Session = Depends(get_db)):
     if flight:
         flight.seats_available += 1
     booking.status = "cancelled"
+    reads.invalidate()
     db.commit()
+    reads.invalidate()
     db.refresh(booking)
     return booking
 
@@ -139,7 +198,9 @@ def register_user(user: UserIn, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Email already registered")
     new_user = User(name=user.name, email=user.email)
     db.add(new_user)
+    reads.invalidate()
     db.commit()
+    reads.invalidate()
     db.refresh(new_user)
     return new_user
 
@@ -150,10 +211,12 @@ def register_user(user: UserIn, db: Session = Depends(get_db)):
     description="Retrieve a user's information (including user_id) by providing both name and email. Returns 404 if not found."
 )
 def get_user_id(name: str, email: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.name == name, User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user 
+    def query():
+        user = db.query(User).filter(User.name == name, User.email == email).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return UserOut.from_orm(user)
+    return coalesced_json(("user_id", name, email), query)
 
 @app.delete(
     "/reset_users",
@@ -167,10 +230,76 @@ def reset_users(db: Session = Depends(get_db)):
         db.query(Booking).delete()
         # Apaga depois os usuários
         db.query(User).delete()
+        reads.invalidate()
         db.commit()
+        reads.invalidate()
 
         return {"message": "All users and their bookings have been deleted successfully."}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to reset users: {str(e)}")
 
+@app.post(
+    "/snapshot",
+    summary="Snapshot the database",
+    description="Capture the current database (or the isolated database selected by the X-Session-Id header) in memory. Later calls to /restore bring any database back to this state. A snapshot of the seeded data is taken on startup.",
+)
+def take_snapshot():
+    snapshot_db(current_session_id.get())
+    return {"message": "Database snapshot captured successfully."}
+
+@app.post(
+    "/restore",
+    summary="Restore the database from the snapshot",
+    description="Overwrite the current database (or the isolated database selected by the X-Session-Id header) with the last snapshot. Much faster than /reset_users or restarting the service.",
+)
+def restore_snapshot():
+    reads.invalidate()
+    try:
+        restore_db(current_session_id.get())
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    reads.invalidate()
+    return {"message": "Database restored from snapshot successfully."}
+
+@app.delete(
+    "/sessions/{session_id}",
+    summary="Delete an isolated session database",
+    description="Dispose of the isolated database created for the given X-Session-Id value. For a session that expired after idling, allow its id to be used again.",
+)
+def drop_session(session_id: str):
+    if not drop_session_db(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session database deleted successfully."}
+
+@app.get(
+    "/admission_stats",
+    summary="Admission control statistics",
+    description="Report requests currently in flight and waiting, and the counts of admitted, queued, rate-limited (429) and shed (503) requests.",
+)
+def admission_stats():
+    return admission.stats()
+
+@app.get(
+    "/coalescing_stats",
+    summary="Read coalescing statistics",
+    description="Report how many identical concurrent read requests (flights, bookings, user lookups) were served from a single shared database query.",
+)
+def coalescing_stats():
+    return reads.stats()
+
+if PROFILING:
+    @app.get(
+        "/debug/profile",
+        response_class=PlainTextResponse,
+        summary="Run the sampling profiler",
+        description="Sample the stacks of all threads for the given number of seconds and return them in collapsed-stack format, ready for flamegraph.pl or speedscope. Only one profile runs at a time. Only available when PROFILING is enabled.",
+    )
+    async def profile(
+        seconds: float = Query(5, gt=0, le=MAX_PROFILE_SECONDS),
+        interval_ms: float = Query(10, ge=1, le=1000),
+    ):
+        try:
+            return await sample_stacks(seconds, interval_ms / 1000)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
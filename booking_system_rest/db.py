@@ -1,22 +1,186 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base
 
 SQLALCHEMY_DATABASE_URL = "sqlite:////tmp/mydb.sqlite3"
 
+# Directory holding the per-session databases used for isolated evaluation runs
+SESSION_DB_DIR = os.environ.get("SESSION_DB_DIR", tempfile.gettempdir())
+# At most MAX_SESSION_DBS session databases exist at once; one unused for
+# SESSION_DB_IDLE_SECONDS is deleted and its id can no longer be used
+MAX_SESSION_DBS = int(os.environ.get("MAX_SESSION_DBS", "256"))
+SESSION_DB_IDLE_SECONDS = float(os.environ.get("SESSION_DB_IDLE_SECONDS", "3600"))
+# How many expired session ids are remembered so their reuse is rejected
+MAX_EXPIRED_SESSION_IDS = 10000
+
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Dependency for FastAPI
+# Session id selected for the current request; None means the shared database
+current_session_id = ContextVar("current_session_id", default=None)
+
+class SessionLimitError(Exception):
+    """Raised when a new session is requested while MAX_SESSION_DBS sessions are in use."""
+
+    def __init__(self, retry_after):
+        super().__init__("Too many active sessions, try again later")
+        self.retry_after = retry_after
+
+class SessionExpiredError(Exception):
+    """Raised when a session's database was deleted after idling."""
+
+    def __init__(self, session_id):
+        super().__init__(f"Session {session_id} expired after being idle; start a new session")
+        self.session_id = session_id
+
+class _SessionDB:
+    def __init__(self, engine):
+        self.engine = engine
+        self.factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self.last_used = time.monotonic()
+
+# Isolated session databases, least recently used first
+_sessions = OrderedDict()
+# Ids of sessions deleted after idling, oldest first
+_expired = OrderedDict()
+_registry_lock = threading.Lock()
+
+# In-memory copies captured with the SQLite backup API, keyed by session id.
+# The None entry is the shared database's snapshot (the seeded baseline) and
+# is the one new sessions start from.
+_snapshots = {}
+_snapshot_lock = threading.Lock()
 
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+def _session_db_path(session_id):
+    digest = hashlib.sha256(session_id.encode()).hexdigest()[:16]
+    return os.path.join(SESSION_DB_DIR, f"booking-session-{digest}.sqlite3")
+
+def _restore_into(target_engine, session_id=None):
+    # A session without its own snapshot falls back to the baseline
+    with _snapshot_lock:
+        snapshot = _snapshots.get(session_id) or _snapshots.get(None)
+        if snapshot is None:
+            raise RuntimeError("No database snapshot has been taken")
+        raw = target_engine.raw_connection()
+        try:
+            snapshot.backup(raw.driver_connection)
+        finally:
+            raw.close()
+
+def _dispose(session_id, session_db):
+    session_db.engine.dispose()
+    try:
+        os.remove(_session_db_path(session_id))
+    except FileNotFoundError:
+        pass
+    with _snapshot_lock:
+        snapshot = _snapshots.pop(session_id, None)
+    if snapshot is not None:
+        snapshot.close()
+
+def _get_session_db(session_id):
+    """Return the isolated database for a session, creating it on first use.
+
+    Session databases are created from the baseline snapshot, so every new
+    session starts from the seeded state. Idle sessions are deleted along the
+    way; sessions still in use never are. Raises SessionExpiredError for a
+    session that was deleted after idling, rather than silently starting it
+    over, and SessionLimitError when MAX_SESSION_DBS sessions are in use."""
+    now = time.monotonic()
+    with _registry_lock:
+        while _sessions:
+            oldest_id, oldest = next(iter(_sessions.items()))
+            if now - oldest.last_used <= SESSION_DB_IDLE_SECONDS:
+                break
+            del _sessions[oldest_id]
+            _dispose(oldest_id, oldest)
+            _expired[oldest_id] = None
+            if len(_expired) > MAX_EXPIRED_SESSION_IDS:
+                _expired.popitem(last=False)
+        session_db = _sessions.get(session_id)
+        if session_db is None:
+            if session_id in _expired:
+                raise SessionExpiredError(session_id)
+            if len(_sessions) >= MAX_SESSION_DBS:
+                oldest = next(iter(_sessions.values()))
+                raise SessionLimitError(oldest.last_used + SESSION_DB_IDLE_SECONDS - now)
+            session_engine = create_engine(
+                f"sqlite:///{_session_db_path(session_id)}",
+                connect_args={"check_same_thread": False},
+            )
+            if None not in _snapshots:
+                Base.metadata.create_all(bind=session_engine)
+            else:
+                _restore_into(session_engine)
+            session_db = _sessions[session_id] = _SessionDB(session_engine)
+        else:
+            _sessions.move_to_end(session_id)
+            session_db.last_used = now
+        return session_db
+
+def get_engine(session_id=None):
+    """Return the engine for the shared database or for an isolated session."""
+    if session_id is None:
+        return engine
+    return _get_session_db(session_id).engine
+
+def get_session_factory(session_id=None):
+    if session_id is None:
+        return SessionLocal
+    return _get_session_db(session_id).factory
+
+def snapshot_db(session_id=None):
+    """Capture the selected database into memory using the SQLite backup API.
+
+    Each session keeps its own snapshot; only the shared database's snapshot
+    is used to create new sessions."""
+    snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+    raw = get_engine(session_id).raw_connection()
+    try:
+        raw.driver_connection.backup(snapshot)
+    finally:
+        raw.close()
+    with _snapshot_lock:
+        previous = _snapshots.get(session_id)
+        _snapshots[session_id] = snapshot
+    if previous is not None:
+        previous.close()
+
+def restore_db(session_id=None):
+    """Overwrite the selected database with its last snapshot, or the baseline if it has none."""
+    _restore_into(get_engine(session_id), session_id)
+
+def drop_session_db(session_id):
+    """Dispose of an isolated session database, or forget that it expired so the
+    id can be used again. Returns False if neither existed."""
+    with _registry_lock:
+        session_db = _sessions.pop(session_id, None)
+        if session_db is None:
+            if session_id not in _expired:
+                return False
+            del _expired[session_id]
+            return True
+        _dispose(session_id, session_db)
+    return True
+
+# Dependency for FastAPI
+
 def get_db():
-    db = SessionLocal()
+    db = get_session_factory(current_session_id.get())()
     try:
         yield db
     finally:
-        db.close() 
+        db.close()
@@ -0,0 +1,63 @@
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent identical reads into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait and receive the same result (or exception). Nothing is cached
+    once the call completes. Writers call invalidate() both before and after
+    committing: the first call keeps reads that start while the commit is in
+    progress off older flights, and the second keeps later reads off flights
+    that began before the commit finished. So a read that starts after a write
+    never joins a flight that began before it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._generation = 0
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            key = (self._generation, key)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.executed += 1
+            call.done.set()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,165 @@
+import asyncio
+import importlib.util
+import pathlib
+import time
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Each service ships its own copy of admission.py; all of them must behave the same
+COPIES = ["booking_system_rest", "booking_system_mcp", "HR_database"]
+
+def load_admission(service):
+    spec = importlib.util.spec_from_file_location(f"{service}_admission", ROOT / service / "admission.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture(params=COPIES)
+def admission(request):
+    return load_admission(request.param)
+
+def test_admits_up_to_the_concurrency_cap(admission):
+    async def scenario():
+        controller = admission.AdmissionController(rate=0, max_concurrency=2, max_queue=0, queue_timeout=1)
+        assert await controller.acquire()
+        assert await controller.acquire()
+        assert not await controller.acquire()
+        controller.release()
+        assert await controller.acquire()
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight"] == 2
+    assert stats["admitted"] == 3
+    assert stats["shed"] == 1
+
+def test_queued_requests_are_handed_slots_in_fifo_order(admission):
+    async def scenario():
+        controller = admission.AdmissionController(rate=0, max_concurrency=1, max_queue=3, queue_timeout=1)
+        assert await controller.acquire()
+        order = []
+
+        async def waiter(name):
+            assert await controller.acquire()
+            order.append(name)
+
+        tasks = [asyncio.create_task(waiter(name)) for name in "abc"]
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 3
+        for _ in range(3):
+            controller.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        controller.release()
+        return order, controller.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["a", "b", "c"]
+    assert stats["in_flight"] == 0
+    assert stats["queued"] == 3
+    assert stats["admitted"] == 4
+
+def test_sheds_when_the_queue_is_full_or_the_wait_times_out(admission):
+    async def scenario():
+        controller = admission.AdmissionController(rate=0, max_concurrency=1, max_queue=1, queue_timeout=0.01)
+        assert await controller.acquire()
+        queued = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        assert not await controller.acquire()  # queue full
+        assert not await queued  # timed out
+        controller.release()
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed"] == 2
+    assert stats["queued"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["waiting"] == 0
+
+def test_slot_handed_over_as_the_timeout_fires_is_not_leaked(admission):
+    async def scenario():
+        controller = admission.AdmissionController(rate=0, max_concurrency=1, max_queue=1, queue_timeout=0.05)
+        assert await controller.acquire()
+        queued = asyncio.create_task(controller.acquire())
+        asyncio.get_running_loop().call_later(0.04, controller.release)
+        await asyncio.sleep(0.01)
+        # Block the loop so the release and the timeout come due in the same iteration
+        time.sleep(0.06)
+        if await queued:
+            controller.release()
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight"] == 0
+    assert stats["admitted"] + stats["shed"] == 2
+
+def test_cancelled_waiter_gives_back_a_handed_over_slot(admission):
+    async def scenario():
+        controller = admission.AdmissionController(rate=0, max_concurrency=1, max_queue=1, queue_timeout=1)
+        assert await controller.acquire()
+        queued = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        controller.release()
+        queued.cancel()
+        # Depending on the Python version the cancellation either wins or the slot is returned
+        try:
+            admitted = await queued
+        except asyncio.CancelledError:
+            admitted = False
+        if admitted:
+            controller.release()
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight"] == 0
+
+def test_token_bucket_limits_each_client_separately(admission):
+    controller = admission.AdmissionController(rate=1, burst=2)
+    assert controller.check_rate("a") == 0
+    assert controller.check_rate("a") == 0
+    assert controller.check_rate("a") > 0
+    assert controller.check_rate("b") == 0
+    assert controller.stats()["rate_limited"] == 1
+
+def test_client_key_takes_the_user_id_from_the_header_only(admission):
+    def scope(headers=(), query_string=b""):
+        return {"type": "http", "headers": list(headers), "query_string": query_string, "client": ("10.0.0.1", 1234)}
+
+    assert admission.client_key(scope([(b"x-user-id", b"7")])) == "user:7"
+    assert admission.client_key(scope(query_string=b"user_id=7")) == "ip:10.0.0.1"
+    assert admission.client_key(scope([(b"x-user-id", b"7"), (b"x-session-id", b"s")])) == "session:s"
+
+def test_only_requests_matched_by_the_exempt_predicate_bypass_admission(admission):
+    async def downstream(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    def is_stream(scope):
+        return scope["path"] == "/stream"
+
+    async def status(middleware, path):
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "headers": [(b"accept", b"text/event-stream")],
+            "query_string": b"",
+            "client": ("10.0.0.1", 1234),
+        }
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware(scope, None, send)
+        return messages[0]["status"]
+
+    async def scenario():
+        controller = admission.AdmissionController(rate=0, max_concurrency=1, max_queue=0)
+        assert await controller.acquire()
+        middleware = admission.AdmissionMiddleware(downstream, controller, exempt=is_stream)
+        return await status(middleware, "/stream"), await status(middleware, "/other")
+
+    assert asyncio.run(scenario()) == (200, 503)